@@ -0,0 +1,72 @@
+"""Compares peak memory of parsing Redash query responses with and without streaming.
+
+Builds query responses whose `visualizations` grow from 1 to 64 MB, serves
+each one in chunks like a downloading HTTP response, and reports the peak
+memory allocated (as traced by tracemalloc) while extracting what stmocli
+needs from it. The streaming peak should stay flat as the payload grows.
+
+Usage: python benchmarks/bench_streaming.py
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from stmocli.stmo import QUERY_FIELDS  # noqa: E402
+from stmocli.streaming import CHUNK_SIZE, ChunkReader, load_fields  # noqa: E402
+
+
+def make_response(megabytes):
+    with open(os.path.join(os.path.dirname(__file__), "..", "tests", "data", "49741.json")) as f:
+        query = json.load(f)
+    visualization = {"type": "CHART", "options": {"series": [{"x": 1.5, "y": "label"}] * 1000}}
+    encoded_size = len(json.dumps(visualization))
+    query["visualizations"] = [visualization] * (megabytes * 1024 * 1024 // encoded_size)
+    return json.dumps(query).encode("utf-8")
+
+
+def chunks(body):
+    for i in range(0, len(body), CHUNK_SIZE):
+        yield body[i:i + CHUNK_SIZE]
+
+
+def parse_buffered(body):
+    # What requests' response.json() does: join the whole body, decode, parse
+    content = b"".join(chunks(body))
+    return json.loads(content.decode("utf-8"))
+
+
+def parse_streaming(body):
+    return load_fields(ChunkReader(chunks(body)), QUERY_FIELDS)
+
+
+def measure(parse, body):
+    # Timed separately, since tracing slows down allocation-heavy parsing
+    start = time.time()
+    assert parse(body)["query"]
+    elapsed = time.time() - start
+
+    tracemalloc.start()
+    parse(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024.0 / 1024.0, elapsed
+
+
+def main():
+    print("{:>10} {:>16} {:>16} {:>12} {:>12}".format(
+        "payload", "buffered peak", "streaming peak", "buffered", "streaming"))
+    for megabytes in (1, 4, 16, 64):
+        body = make_response(megabytes)
+        buffered_peak, buffered_time = measure(parse_buffered, body)
+        streaming_peak, streaming_time = measure(parse_streaming, body)
+        print("{:>7.1f} MB {:>13.1f} MB {:>13.1f} MB {:>10.2f} s {:>10.2f} s".format(
+            len(body) / 1024.0 / 1024.0, buffered_peak, streaming_peak,
+            buffered_time, streaming_time))
+
+
+if __name__ == "__main__":
+    main()
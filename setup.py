@@ -6,10 +6,14 @@ test_deps = [
     'pytest-cov',
     'pytest',
     'httmock',
-    'mock;python_version<"3.3"'
+    'mock;python_version<"3.3"',
+    'aiohttp;python_version>="3.7"',
+    'ijson>=3.1;python_version>="3.5"',
 ]
 
 extras = {
+    'async': ['aiohttp;python_version>="3.7"'],
+    'streaming': ['ijson>=3.1;python_version>="3.5"'],
     'testing': test_deps,
 }
 
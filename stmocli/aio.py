@@ -0,0 +1,225 @@
+"""An asyncio counterpart to `stmocli.stmo.STMO`.
+
+Requires aiohttp, which is installed with the `async` extra.
+"""
+import asyncio
+import json
+import os
+import time
+
+import aiohttp
+from redash_client.client import RedashClient
+from requests.compat import urljoin
+
+from .conf import Conf, QueryInfo
+from .fingerprint import fingerprint, fingerprint_file
+from .metrics import registry
+
+
+def _read_file(file_name):
+    with open(file_name, 'r') as fin:
+        return fin.read()
+
+
+def _write_file(file_name, contents):
+    with open(file_name, 'w') as outfile:
+        outfile.write(contents)
+
+
+def _is_formatting_of(file_name, query_info):
+    return (os.path.exists(file_name) and
+            fingerprint_file(file_name) == query_info.fingerprint)
+
+
+class AsyncSTMO(object):
+    """Non-blocking version of STMO for use inside asyncio applications.
+
+    Behaves like STMO, and reads and writes the same Conf, but talks to Redash
+    through a shared aiohttp connection pool. At most `concurrency` requests
+    are in flight at once. File and conf writes run in the default executor
+    so they don't block the event loop; conf updates are serialized.
+
+    Each track, pull or push saves the conf file by default. When syncing
+    many queries at once, pass `save=False` and call `save_conf` once at the
+    end instead of rewriting the conf file for every query.
+
+    Use it as an async context manager, or call `close` when done:
+
+        async with AsyncSTMO(api_key) as stmo:
+            await asyncio.gather(*[stmo.pull_query(f, save=False) for f in files])
+            await stmo.save_conf()
+    """
+    RedashClientException = RedashClient.RedashClientException
+
+    def __init__(self, redash_api_key, conf=None, concurrency=8,
+                 api_base_url=RedashClient.API_BASE_URL, timeout=300):
+        self.conf = conf or Conf()
+        self.redash_api_key = redash_api_key
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.api_base_url = api_base_url
+        self._session = None
+        self._semaphore = None
+        self._conf_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_session(self):
+        # Created lazily so that they belong to the running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    def _get_conf_lock(self):
+        if self._conf_lock is None:
+            self._conf_lock = asyncio.Lock()
+        return self._conf_lock
+
+    async def _run_blocking(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def _make_request(self, method, url_path, data=None):
+        session = self._get_session()
+        url = urljoin(self.api_base_url, url_path)
+        async with self._semaphore:
+            registry.inc("http_requests_total")
+            start = time.time()
+            try:
+                async with session.request(method, url, data=data,
+                                           params={"api_key": self.redash_api_key}) as response:
+                    status = response.status
+                    content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                registry.inc("http_requests_failed_total")
+                raise self.RedashClientException(
+                    "Unable to communicate with redash: {}".format(e), e)
+            finally:
+                registry.observe("http_request_duration_seconds", time.time() - start)
+
+        if data:
+            registry.inc("http_bytes_sent_total", len(data))
+        registry.inc("http_bytes_received_total", len(content))
+        if status != 200:
+            registry.inc("http_requests_failed_total")
+            raise self.RedashClientException(
+                "Error status returned: {} {}".format(status, content), status)
+        try:
+            return json.loads(content.decode("utf-8"))
+        except ValueError as e:
+            raise self.RedashClientException("Unable to parse JSON response: {}".format(e))
+
+    async def _update_conf(self, method, file_name, query_info, save):
+        async with self._get_conf_lock():
+            if save:
+                return await self._run_blocking(method, file_name, query_info)
+            return method(file_name, query_info, save=False)
+
+    async def save_conf(self):
+        """Writes the conf file, e.g. after a batch of calls with `save=False`."""
+        async with self._get_conf_lock():
+            await self._run_blocking(self.conf.save)
+
+    async def get_query(self, query_id):
+        """Fetches information about a query from Redash.
+
+        Args:
+            query_id (int, str): Redash query ID
+
+        Returns:
+            query (dict): The response from redash, representing a Query model.
+        """
+        return await self._make_request("GET", "queries/{}".format(query_id))
+
+    async def track_query(self, query_id, file_name, save=True):
+        """Saves a query to disk and adds it to the conf file.
+
+        Args:
+            query_id (int, str): Redash query ID
+            file_name (str, callable): Name of the file_name to write the query out to.
+                If callable, receives the Redash query object as a parameter.
+            save (bool): Whether to write the conf file now
+
+        Returns:
+            query_info (QueryInfo): Metadata about the tracked query, or None
+                if the file name is already tracked, in which case the file
+                is left alone
+        """
+        query = await self.get_query(query_id)
+        query_file_name = file_name(query) if callable(file_name) else file_name
+        if self.conf.has_query(query_file_name):
+            return None
+        await self._run_blocking(_write_file, query_file_name, query["query"])
+        query_info = QueryInfo.from_query(query)
+        await self._update_conf(self.conf.add_query, query_file_name, query_info, save)
+        return query_info
+
+    async def pull_query(self, file_name, save=True):
+        """Pulls remote query data to disk
+
+        The file is only rewritten if the remote SQL differs from the local
+        SQL by more than formatting and comments.
+
+        Args:
+            file_name (str): Name of the file_name to update
+            save (bool): Whether to write the conf file now
+
+        Returns:
+            query_info (QueryInfo): Metadata about the tracked query
+        """
+        query_info = self.conf.get_query(file_name)
+        query = await self.get_query(query_info.id)
+        new_query_info = QueryInfo.from_query(query)
+
+        if not await self._run_blocking(_is_formatting_of, file_name, new_query_info):
+            await self._run_blocking(_write_file, file_name, query["query"])
+
+        await self._update_conf(self.conf.update_query, file_name, new_query_info, save)
+        return new_query_info
+
+    async def push_query(self, file_name, save=True):
+        """Replaces the SQL on Redash with the local version of a tracked query.
+
+        Args:
+            file_name (str): file_name of a tracked query
+            save (bool): Whether to write the conf file now
+
+        Returns:
+            query_info (QueryInfo): The query metadata
+
+        Throws:
+            KeyError: if query is not tracked
+            RedashClientException
+        """
+        query_info = self.conf.get_query(file_name)
+        sql = await self._run_blocking(_read_file, file_name)
+        args = {
+            "data_source_id": query_info.data_source_id,
+            "query": sql,
+            "name": query_info.name,
+            "description": query_info.description,
+            "id": query_info.id,
+        }
+        if query_info.options:
+            args["options"] = query_info.options
+        await self._make_request("POST", "queries/{}".format(query_info.id), json.dumps(args))
+        await self._make_request("POST", "queries/{}/refresh".format(query_info.id))
+
+        query_info.fingerprint = fingerprint(sql)
+        await self._update_conf(self.conf.update_query, file_name, query_info, save)
+        return query_info
+
+    async def fork_query(self, query_id, new_query_file_name, save=True):
+        result = await self._make_request("POST", "queries/{}/fork".format(query_id))
+        return await self.track_query(result["id"], new_query_file_name, save)
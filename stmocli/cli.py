@@ -1,13 +1,44 @@
 import hashlib
+import json
 import os
 import sys
 
 import click
 
+from .metrics import registry
 from .stmo import STMO
 from .util import name_to_stub
 
 
+def json_output():
+    return click.get_current_context().meta.get("stmocli.output") == "json"
+
+
+def emit(event, message=None, err=False, outcome=None, **fields):
+    """Reports an event to the user, as text or as a line of JSON.
+
+    Args:
+        event (str): Machine-readable name of the event
+        message (str): Human-readable description. Events without one are
+            only shown with --output json.
+        err (bool): Whether to write to stderr
+        outcome (str): For events about syncing a single query, one of
+            "updated", "skipped" or "failed"; counted in the run's metrics.
+        fields: Extra values to include in JSON output
+    """
+    if outcome:
+        registry.inc("queries_processed_total")
+        registry.inc("queries_{}_total".format(outcome))
+
+    if json_output():
+        fields["event"] = event
+        if message:
+            fields["message"] = message
+        click.echo(json.dumps(fields, sort_keys=True), err=err)
+    elif message:
+        click.echo(message, err=err)
+
+
 @click.group(context_settings={'help_option_names': ['-h', '--help']})
 @click.option(
     '--redash_api_key',
@@ -15,9 +46,26 @@ from .util import name_to_stub
     help=("A redash user API key, from your user settings page. "
           "Defaults to the value of the REDASH_API_KEY environment variable.")
 )
+@click.option(
+    '--output',
+    type=click.Choice(['text', 'json']),
+    default='text',
+    help="Print human-readable messages, or one JSON object per line."
+)
+@click.option(
+    '--metrics_file',
+    type=click.Path(dir_okay=False),
+    help=("Write Prometheus metrics for this run to this file when done, "
+          "e.g. for the node_exporter textfile collector.")
+)
 @click.pass_context
-def cli(ctx, redash_api_key):
+def cli(ctx, redash_api_key, output, metrics_file):
     """St. Mocli is a command-line interface for sql.telemetry.mozilla.org."""
+    ctx.meta["stmocli.output"] = output
+    registry.reset()
+    if metrics_file:
+        ctx.call_on_close(lambda: registry.write_textfile(
+            metrics_file, {"command": ctx.invoked_subcommand}))
     ctx.obj = STMO(redash_api_key)
 
 
@@ -29,7 +77,8 @@ def init(stmo):
     Creates an empty .stmocli.conf in the current directory, which will hold
     stmocli's metadata.
     """
-    stmo.conf.init_file()
+    created = stmo.conf.init_file()
+    emit("init", path=stmo.conf.path, created=created)
 
 
 @cli.command()
@@ -43,25 +92,41 @@ def track(stmo, query_id, file_name):
 
     FILE_NAME: The filename to use for the query SQL in the local repository.
     You will be prompted with a suggested filename if you don't provide one.
+    Required with --output json.
 
     Downloads the SQL query associated with the given query ID and saves it in a file
     with the given name.
     """
+    if not file_name and json_output():
+        emit("failed", "A FILE_NAME is required with --output json", err=True,
+             outcome="failed", query_id=query_id)
+        sys.exit(1)
+
+    used_file_name = [file_name]
+
     def make_file_name(query):
-        if file_name:
-            return file_name
-        default_file_name = "{}.sql".format(
-            name_to_stub(query["name"]),
-        )
-        return click.prompt("Filename for tracked query SQL", default=default_file_name)
+        if not file_name:
+            default_file_name = "{}.sql".format(
+                name_to_stub(query["name"]),
+            )
+            used_file_name[0] = click.prompt("Filename for tracked query SQL",
+                                             default=default_file_name)
+        return used_file_name[0]
 
     try:
-        stmo.track_query(query_id, make_file_name)
+        query_info = stmo.track_query(query_id, make_file_name)
     except STMO.RedashClientException as e:
-        click.echo("Failed to track Query ID {}: {}".format(query_id, e), err=True)
+        emit("failed", "Failed to track Query ID {}: {}".format(query_id, e), err=True,
+             outcome="failed", query_id=query_id)
         sys.exit(1)
 
-    click.echo("Tracking Query ID {} in {}".format(query_id, file_name))
+    if query_info is None:
+        emit("already_tracked", 'Query "{}" already tracked!'.format(used_file_name[0]),
+             outcome="skipped", query_id=query_id, file_name=used_file_name[0])
+        return
+
+    emit("tracked", "Tracking Query ID {} in {}".format(query_id, used_file_name[0]),
+         outcome="updated", query_id=query_id, file_name=used_file_name[0])
 
 
 @cli.command()
@@ -75,51 +140,87 @@ def pull(stmo, file_names):
     for file_name in file_names:
         query_info = stmo.get_query_metadata(file_name)
         if not query_info:
-            click.echo('Query "{}" not tracked'.format(file_name))
+            emit("not_tracked", 'Query "{}" not tracked'.format(file_name),
+                 outcome="failed", file_name=file_name)
             continue
 
         try:
             new_query_info = stmo.pull_query(file_name)
         except STMO.RedashClientException as e:
-            click.echo("Failed to pull query {}: {}".format(file_name, e), err=True)
+            emit("failed", "Failed to pull query {}: {}".format(file_name, e), err=True,
+                 outcome="failed", query_id=query_info.id, file_name=file_name)
             continue
 
-        if query_info.query_hash and query_info.query_hash == new_query_info.query_hash:
-            click.echo("Query ID {} ({}) is up to date".format(query_info.id, file_name))
+        if query_info.fingerprint:
+            up_to_date = query_info.fingerprint == new_query_info.fingerprint
         else:
-            click.echo("Query ID {} ({}) has been updated".format(query_info.id, file_name))
+            up_to_date = query_info.query_hash == new_query_info.query_hash
+        if query_info.query_hash and up_to_date:
+            emit("up_to_date", "Query ID {} ({}) is up to date".format(query_info.id, file_name),
+                 outcome="skipped", query_id=query_info.id, file_name=file_name)
+        else:
+            emit("updated", "Query ID {} ({}) has been updated".format(query_info.id, file_name),
+                 outcome="updated", query_id=query_info.id, file_name=file_name)
 
 
 @cli.command()
 @click.pass_obj
 @click.argument('file_names', required=False, nargs=-1)
-def push(stmo, file_names):
+@click.option('--force', is_flag=True,
+              help="Push even if the SQL only differs in formatting or comments.")
+def push(stmo, file_names, force):
     """Uploads a tracked query to STMO.
 
     FILE_NAME: The filename of the tracked query SQL.
 
     Overwrites the STMO query SQL with the version in the local repository.
+    Queries whose SQL hasn't changed since the last pull or push, ignoring
+    formatting and comments, are skipped unless --force is given.
     """
     if not file_names:
         file_names = stmo.get_tracked_filenames()
 
     for file_name in file_names:
         try:
+            if not force and not stmo.is_modified(file_name):
+                query_id = stmo.conf.get_query(file_name).id
+                emit("unchanged", "Query ID {} ({}) is unchanged, skipping".format(
+                    query_id, file_name), outcome="skipped", query_id=query_id,
+                    file_name=file_name)
+                continue
             queryinfo = stmo.push_query(file_name)
         except stmo.RedashClientException as e:
-            click.echo("Failed to update query from {}: {}".format(file_name, e), err=True)
+            emit("failed", "Failed to update query from {}: {}".format(file_name, e), err=True,
+                 outcome="failed", file_name=file_name)
             sys.exit(1)
-        except KeyError as e:
-            click.echo("Failed to update query from {}: No such query, "
-                       "maybe you need to 'track' first".format(file_name), err=True)
+        except KeyError:
+            emit("not_tracked", "Failed to update query from {}: No such query, "
+                 "maybe you need to 'track' first".format(file_name), err=True,
+                 outcome="failed", file_name=file_name)
             sys.exit(1)
 
         with open(file_name, "rt") as f:
             query = f.read()
 
         m = hashlib.md5(query.encode("utf-8"))
-        click.echo("Query ID {} updated with content from {} (md5 {})".format(
-            queryinfo.id, file_name, m.hexdigest()))
+        emit("updated", "Query ID {} updated with content from {} (md5 {})".format(
+            queryinfo.id, file_name, m.hexdigest()), outcome="updated",
+            query_id=queryinfo.id, file_name=file_name, md5=m.hexdigest())
+
+
+@cli.command()
+@click.pass_obj
+def status(stmo):
+    """Lists tracked queries with local changes.
+
+    Shows each tracked query whose SQL changed since it was last pulled or
+    pushed. Changes to formatting and comments are ignored. Doesn't contact STMO.
+    """
+    for file_name in sorted(stmo.get_tracked_filenames()):
+        if not os.path.exists(file_name):
+            emit("missing", "missing:  {}".format(file_name), file_name=file_name)
+        elif stmo.is_modified(file_name):
+            emit("modified", "modified: {}".format(file_name), file_name=file_name)
 
 
 @cli.command()
@@ -135,13 +236,116 @@ def view(stmo, file_name):
     try:
         url = stmo.url_for_query(file_name)
     except KeyError:
-        click.echo("Couldn't find a query ID for {}: No such query, "
-                   "maybe you need to 'track' first".format(file_name),
-                   err=True)
+        emit("not_tracked", "Couldn't find a query ID for {}: No such query, "
+             "maybe you need to 'track' first".format(file_name),
+             err=True, file_name=file_name)
         sys.exit(1)
+    emit("view", url=url, file_name=file_name)
     click.launch(url)
 
 
+@cli.command(name='export')
+@click.pass_obj
+@click.argument('archive')
+@click.option('--results', is_flag=True,
+              help="Also fetch and include the latest results of each query.")
+@click.option('--jobs', default=4, show_default=True,
+              help="Number of concurrent requests to STMO.")
+def export_(stmo, archive, results, jobs):
+    """Exports all tracked queries to a single archive.
+
+    ARCHIVE: The file to write, a gzipped file with one JSON object per query.
+
+    The archive holds each query's SQL and metadata and can be restored on any
+    Redash instance with 'import'.
+    """
+    try:
+        count = stmo.export_queries(archive, include_results=results, jobs=jobs)
+    except STMO.RedashClientException as e:
+        emit("failed", "Failed to export queries: {}".format(e), err=True)
+        sys.exit(1)
+
+    emit("exported", "Exported {} queries to {}".format(count, archive),
+         count=count, archive=archive)
+
+
+@cli.command(name='import')
+@click.pass_obj
+@click.argument('archive')
+@click.option('--data_source_id', type=int, default=None,
+              help="Create all queries against this data source instead of the archived ones.")
+@click.option('--jobs', default=4, show_default=True,
+              help="Number of concurrent requests to STMO.")
+def import_(stmo, archive, data_source_id, jobs):
+    """Creates and tracks the queries in an archive.
+
+    ARCHIVE: An archive written by 'export'.
+
+    Each query is created as a new STMO query, and its SQL is saved under its
+    original filename. Filenames that are already tracked are skipped, and
+    filenames outside the current directory are rejected.
+    """
+    try:
+        imported, skipped, failed = stmo.import_queries(
+            archive, data_source_id=data_source_id, jobs=jobs)
+    except STMO.RedashClientException as e:
+        emit("failed", "Failed to import queries: {}".format(e), err=True)
+        sys.exit(1)
+
+    for file_name, query_info in imported:
+        emit("created", "Created Query ID {} from {}".format(query_info.id, file_name),
+             outcome="updated", query_id=query_info.id, file_name=file_name)
+    for file_name in skipped:
+        emit("already_tracked", 'Query "{}" already tracked, skipping'.format(file_name),
+             outcome="skipped", file_name=file_name)
+    for file_name, reason in failed:
+        emit("failed", 'Failed to import "{}": {}'.format(file_name, reason), err=True,
+             outcome="failed", file_name=file_name)
+    if failed:
+        sys.exit(1)
+
+
+@cli.command()
+@click.pass_obj
+def index(stmo):
+    """Syncs a local search index of all STMO queries.
+
+    Downloads the SQL and metadata of every query visible to you into
+    .stmocli.index in the current directory. Subsequent runs only download
+    queries that changed since the last sync.
+    """
+    try:
+        updated, removed = stmo.sync_index()
+    except STMO.RedashClientException as e:
+        emit("failed", "Failed to sync query index: {}".format(e), err=True)
+        sys.exit(1)
+
+    emit("indexed", "Indexed {} new or changed queries, removed {}".format(
+        len(updated), len(removed)), updated=updated, removed=removed)
+
+
+@cli.command()
+@click.pass_obj
+@click.argument('term')
+def search(stmo, term):
+    """Searches the local index of STMO queries.
+
+    TERM: Text to look for in query names, descriptions and SQL, e.g. a table name.
+
+    Run 'index' first to build or refresh the index.
+    """
+    if not stmo.index.exists():
+        emit("no_index", "No query index found, maybe you need to 'index' first", err=True)
+        sys.exit(1)
+
+    for query_id, name, file_name in stmo.search_index(term):
+        if file_name:
+            message = "Query ID {} ({}): tracked in {}".format(query_id, name, file_name)
+        else:
+            message = "Query ID {} ({}): not tracked".format(query_id, name)
+        emit("match", message, query_id=query_id, name=name, file_name=file_name)
+
+
 @cli.command()
 @click.pass_obj
 @click.argument('query_to_fork')
@@ -158,24 +362,32 @@ def fork(stmo, query_to_fork, new_query_file_name):
         try:
             query_id = stmo.conf.get_query(query_to_fork).id
         except KeyError:
-            click.echo("Couldn't find a query ID for {}. "
-                       "Did you need to 'track' it?".format(query_to_fork),
-                       err=True)
+            emit("not_tracked", "Couldn't find a query ID for {}. "
+                 "Did you need to 'track' it?".format(query_to_fork),
+                 err=True, file_name=query_to_fork)
             sys.exit(1)
     elif query_to_fork.isnumeric():
         query_id = query_to_fork
     else:
-        click.echo("Couldn't fork that query; no file or query named {}.".format(query_to_fork),
-                   err=True)
+        emit("not_found", "Couldn't fork that query; no file or query named {}.".format(
+            query_to_fork), err=True)
+        sys.exit(1)
+
+    if stmo.conf.has_query(new_query_file_name):
+        emit("already_tracked", 'Query "{}" already tracked!'.format(new_query_file_name),
+             err=True, outcome="failed", file_name=new_query_file_name)
         sys.exit(1)
 
     try:
         result = stmo.fork_query(query_id, new_query_file_name)
     except STMO.RedashClientException:
-        click.echo("Couldn't find a query with ID {} on the server.".format(query_id), err=True)
+        emit("failed", "Couldn't find a query with ID {} on the server.".format(query_id),
+             err=True, outcome="failed", query_id=query_id)
         sys.exit(1)
 
-    click.echo("Forked query {} to {}: {}".format(query_id, new_query_file_name, result.name))
+    emit("forked", "Forked query {} to {}: {}".format(query_id, new_query_file_name, result.name),
+         outcome="updated", query_id=query_id, new_query_id=result.id,
+         file_name=new_query_file_name)
 
 
 if __name__ == '__main__':
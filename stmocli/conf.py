@@ -3,6 +3,9 @@ import os
 
 import attr
 
+from .fingerprint import fingerprint
+from .metrics import registry
+
 default_path = './.stmocli.conf'
 
 
@@ -24,23 +27,28 @@ class Conf(object):
         return True
 
     def save(self):
-        with open(self.path, 'w') as conf_file:
-            conf_file.write(json.dumps(self.contents, sort_keys=True,
-                                       indent=2, separators=(',', ': ')))
+        with registry.timer("conf_save_duration_seconds"):
+            with open(self.path, 'w') as conf_file:
+                conf_file.write(json.dumps(self.contents, sort_keys=True,
+                                           indent=2, separators=(',', ': ')))
 
-    def add_query(self, file_name, query_metadata):
+    def add_query(self, file_name, query_metadata, save=True):
+        """Tracks a query. Returns False if file_name is already tracked."""
         if file_name in self.contents:
-            print('Query "{}" already tracked!'.format(file_name))
-        else:
-            self.contents[file_name] = query_metadata.to_dict()
+            return False
+        self.contents[file_name] = query_metadata.to_dict()
+        if save:
             self.save()
+        return True
 
-    def update_query(self, file_name, query_metadata):
-        if file_name in self.contents:
-            self.contents[file_name] = query_metadata.to_dict()
+    def update_query(self, file_name, query_metadata, save=True):
+        """Updates a tracked query. Returns False if file_name isn't tracked."""
+        if file_name not in self.contents:
+            return False
+        self.contents[file_name] = query_metadata.to_dict()
+        if save:
             self.save()
-        else:
-            print('Query "{}" not tracked!'.format(file_name))
+        return True
 
     def get_query(self, file_name):
         return QueryInfo.from_dict(self.contents[file_name])
@@ -61,6 +69,7 @@ class QueryInfo(object):
     schedule = attr.ib()
     options = attr.ib()
     query_hash = attr.ib()
+    fingerprint = attr.ib(default=None)
 
     @id.validator
     def id_is_not_none(instance, attribute, value):
@@ -75,5 +84,12 @@ class QueryInfo(object):
         fields = [field.name for field in attr.fields(cls)]
         return cls(**{k: d.get(k, None) for k in fields})
 
+    @classmethod
+    def from_query(cls, query):
+        """Instantiate a QueryInfo from a Redash query object, fingerprinting its SQL."""
+        query_info = cls.from_dict(query)
+        query_info.fingerprint = fingerprint(query["query"])
+        return query_info
+
     def to_dict(self):
         return attr.asdict(self)
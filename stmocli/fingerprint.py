@@ -0,0 +1,79 @@
+import hashlib
+import os
+import re
+
+# Comments and whitespace match no group, so they are dropped. String
+# literals, quoted identifiers and dollar-quoted bodies are kept verbatim so
+# that their contents are never normalized; doubled quotes stay inside the
+# literal. An opening quote or comment that is never closed matches
+# `unterminated`.
+_TOKEN = re.compile(r"""
+    --[^\n]*
+  | /\*.*?\*/
+  | \s+
+  | (?P<token>
+      '[^']*(?:''[^']*)*'
+    | "[^"]*(?:""[^"]*)*"
+    | `[^`]*`
+    | \$(?P<tag>\w*)\$.*?\$(?P=tag)\$
+    | \w+
+    )
+  | (?P<unterminated>['"`]|/\*|\$\w*\$)
+  | (?P<other>.)
+""", re.DOTALL | re.VERBOSE)
+
+_KEYWORDS = frozenset("""
+    all and any array as asc between by case cast count cross current_date
+    current_timestamp date day delete desc distinct else end escape except
+    exists extract false filter first following for from full group having
+    if ilike in inner insert intersect interval into is join last lateral
+    left like limit month natural not null nulls offset on or order outer
+    over partition preceding range recursive right rollup row rows select
+    set table tablesample then timestamp true unbounded union unnest update
+    using values when where window with year
+""".split())
+
+# Maps each file's absolute path to its last seen (mtime, size, fingerprint)
+_file_cache = {}
+
+
+def fingerprint(sql):
+    """
+    Computes a fingerprint of a SQL string that ignores formatting.
+
+    Comments and whitespace between tokens are dropped and keywords are
+    case-folded, so "SELECT a\\nFROM t -- note" and "select a from t" share
+    a fingerprint. String literals and identifiers are compared exactly.
+
+    If the SQL has an unterminated string, quoted identifier or comment, or
+    a string or quoted identifier containing a backslash (an escape in some
+    dialects but not in others), its extent is ambiguous, so the raw SQL is
+    hashed instead and any change counts as a change.
+    """
+    tokens = []
+    for token, _tag, unterminated, other in _TOKEN.findall(sql):
+        if unterminated or (token[:1] in ("'", '"') and "\\" in token):
+            return hashlib.md5(sql.encode("utf-8")).hexdigest()
+        token = token or other
+        if token:
+            lowered = token.lower()
+            tokens.append(lowered if lowered in _KEYWORDS else token)
+    return hashlib.md5(" ".join(tokens).encode("utf-8")).hexdigest()
+
+
+def fingerprint_file(path):
+    """
+    Fingerprints the SQL in a file.
+
+    The result is cached until the file's modification time or size changes,
+    so repeated calls for an unchanged file don't read it again. Only the
+    latest fingerprint of each path is kept.
+    """
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    cached = _file_cache.get(path)
+    if cached is None or cached[:2] != (stat.st_mtime, stat.st_size):
+        with open(path, 'r') as fin:
+            cached = (stat.st_mtime, stat.st_size, fingerprint(fin.read()))
+        _file_cache[path] = cached
+    return cached[2]
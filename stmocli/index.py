@@ -0,0 +1,69 @@
+import os
+import sqlite3
+
+default_path = './.stmocli.index'
+
+
+class QueryIndex(object):
+    """A local full-text index over the queries visible on Redash.
+
+    Backed by a SQLite FTS4 table. The connection is opened lazily so that
+    commands which never touch the index don't create the file.
+    """
+    def __init__(self, path=default_path):
+        self.path = os.path.abspath(path)
+        self._db = None
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS queries "
+                "(id INTEGER PRIMARY KEY, updated_at TEXT)")
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS query_text "
+                "USING fts4(name, description, query)")
+        return self._db
+
+    def get_versions(self):
+        """Returns a dict mapping each indexed query ID to its updated_at."""
+        return {str(k): v for k, v in self.db.execute("SELECT id, updated_at FROM queries")}
+
+    def add_query(self, query):
+        """Inserts or replaces a Redash query object in the index."""
+        query_id = int(query["id"])
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO queries (id, updated_at) VALUES (?, ?)",
+                (query_id, query.get("updated_at")))
+            self.db.execute("DELETE FROM query_text WHERE docid = ?", (query_id,))
+            self.db.execute(
+                "INSERT INTO query_text (docid, name, description, query) "
+                "VALUES (?, ?, ?, ?)",
+                (query_id, query.get("name") or "", query.get("description") or "",
+                 query.get("query") or ""))
+
+    def remove_queries(self, query_ids):
+        with self.db:
+            for query_id in query_ids:
+                self.db.execute("DELETE FROM queries WHERE id = ?", (int(query_id),))
+                self.db.execute("DELETE FROM query_text WHERE docid = ?", (int(query_id),))
+
+    def search(self, term):
+        """Finds indexed queries whose name, description or SQL contain term.
+
+        The term is matched as a phrase, so punctuated table names like
+        "telemetry.main_summary" work as expected.
+
+        Returns:
+            results (list): (query_id, name) tuples, ordered by query ID
+        """
+        phrase = '"{}"'.format(term.replace('"', '""'))
+        rows = self.db.execute(
+            "SELECT docid, name FROM query_text WHERE query_text MATCH ? ORDER BY docid",
+            (phrase,))
+        return [(str(query_id), name) for query_id, name in rows]
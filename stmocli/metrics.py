@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+# Every metric stmocli records, with its type and help text.
+METRICS = {
+    "queries_processed_total": ("counter", "Queries stmocli attempted to sync."),
+    "queries_updated_total": ("counter", "Queries that were changed locally or on Redash."),
+    "queries_skipped_total": ("counter", "Queries that were already up to date."),
+    "queries_failed_total": ("counter", "Queries that could not be synced."),
+    "http_requests_total": ("counter", "Requests made to Redash."),
+    "http_requests_failed_total": ("counter", "Requests to Redash that failed."),
+    "http_bytes_sent_total": ("counter", "Request body bytes sent to Redash."),
+    "http_bytes_received_total": ("counter", "Response body bytes received from Redash."),
+    "http_request_duration_seconds": ("histogram", "Latency of requests to Redash."),
+    "conf_save_duration_seconds": ("histogram", "Time spent writing .stmocli.conf."),
+    "run_duration_seconds": ("gauge", "Wall-clock duration of the stmocli run."),
+    "last_run_timestamp_seconds": ("gauge", "Unix time at which the stmocli run finished."),
+}
+
+
+class Metrics(object):
+    """Counters and histograms describing a single stmocli run.
+
+    Recording a value is a dict update under a lock, so it is cheap enough to
+    call from hot paths and safe to call from worker threads. Nothing is
+    written until `write_textfile` is called.
+    """
+    prefix = "stmocli_"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.values = {}
+            self.histograms = {}
+            self.started_at = time.time()
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.values[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+            histogram = self.histograms[name]
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start)
+
+    def render(self, labels=None):
+        """Formats all metrics in the Prometheus text exposition format.
+
+        Args:
+            labels (dict): Labels to attach to every sample
+
+        Returns:
+            text (str)
+        """
+        labels = labels or {}
+
+        def sample(name, value, extra=None):
+            pairs = sorted(labels.items()) + (extra or [])
+            label_text = ",".join('{}="{}"'.format(k, v) for k, v in pairs)
+            if label_text:
+                return "{}{}{{{}}} {}".format(self.prefix, name, label_text, value)
+            return "{}{} {}".format(self.prefix, name, value)
+
+        lines = []
+        with self._lock:
+            for name in sorted(METRICS):
+                kind, help_text = METRICS[name]
+                lines.append("# HELP {}{} {}".format(self.prefix, name, help_text))
+                lines.append("# TYPE {}{} {}".format(self.prefix, name, kind))
+                if kind == "histogram":
+                    buckets, total, count = self.histograms.get(
+                        name, [[0] * len(DEFAULT_BUCKETS), 0.0, 0])
+                    for bound, bucket_count in zip(DEFAULT_BUCKETS, buckets):
+                        lines.append(sample(name + "_bucket", bucket_count,
+                                            [("le", repr(float(bound)))]))
+                    lines.append(sample(name + "_bucket", count, [("le", "+Inf")]))
+                    lines.append(sample(name + "_sum", total))
+                    lines.append(sample(name + "_count", count))
+                else:
+                    lines.append(sample(name, self.values.get(name, 0)))
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, labels=None):
+        """Atomically writes all metrics to a file for the node_exporter textfile collector.
+
+        The metrics are written to a temporary file in the same directory,
+        which is then renamed over `path`, so the collector never sees a
+        partially written file.
+        """
+        finished_at = time.time()
+        self.set("run_duration_seconds", finished_at - self.started_at)
+        self.set("last_run_timestamp_seconds", finished_at)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".stmocli-metrics-")
+        try:
+            with os.fdopen(fd, 'w') as tmp_file:
+                tmp_file.write(self.render(labels))
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+registry = Metrics()
@@ -1,8 +1,88 @@
+import gzip
+import json
+import os
+from multiprocessing.pool import ThreadPool
+import time
+
+import attr
 from redash_client.client import RedashClient
 import requests
 from requests.compat import urljoin
 
 from .conf import Conf, QueryInfo
+from .fingerprint import fingerprint, fingerprint_file
+from .index import QueryIndex
+from .metrics import registry
+from .streaming import CHUNK_SIZE, PARSE_ERRORS, ChunkReader, load_fields, load_item, load_page
+from .util import chunked
+
+# The parts of a Redash query object that stmocli uses
+QUERY_FIELDS = frozenset(
+    [field.name for field in attr.fields(QueryInfo)] + ["query", "updated_at"])
+
+
+class InstrumentedRedashClient(RedashClient):
+    """A RedashClient that records request latency and size in the metrics registry."""
+    def _make_request(self, request_function, url, req_args={}):
+        registry.inc("http_requests_total")
+        start = time.time()
+        try:
+            results, response = super(InstrumentedRedashClient, self)._make_request(
+                request_function, url, req_args)
+        except RedashClient.RedashClientException:
+            registry.inc("http_requests_failed_total")
+            raise
+        finally:
+            registry.observe("http_request_duration_seconds", time.time() - start)
+        if req_args:
+            registry.inc("http_bytes_sent_total", len(req_args))
+        registry.inc("http_bytes_received_total", len(response.content))
+        return results, response
+
+    def _make_streaming_request(self, url, parse):
+        """GETs a URL and parses the response body as it is downloaded.
+
+        Args:
+            url (str): The URL to fetch
+            parse (callable): Receives the body as a binary file-like object,
+                and returns the parsed result
+
+        Returns:
+            result: The return value of parse
+        """
+        registry.inc("http_requests_total")
+        start = time.time()
+        received = [0]
+
+        def chunks():
+            for chunk in response.iter_content(CHUNK_SIZE):
+                received[0] += len(chunk)
+                yield chunk
+
+        try:
+            try:
+                response = requests.get(url, stream=True)
+            except requests.RequestException as e:
+                raise self.RedashClientException(
+                    "Unable to communicate with redash: {}".format(e), e)
+            try:
+                if response.status_code != 200:
+                    raise self.RedashClientException(
+                        "Error status returned: {} {}".format(
+                            response.status_code, response.content),
+                        response.status_code)
+                return parse(ChunkReader(chunks()))
+            except PARSE_ERRORS as e:
+                raise self.RedashClientException(
+                    "Unable to parse JSON response: {}".format(e))
+            finally:
+                response.close()
+        except RedashClient.RedashClientException:
+            registry.inc("http_requests_failed_total")
+            raise
+        finally:
+            registry.observe("http_request_duration_seconds", time.time() - start)
+            registry.inc("http_bytes_received_total", received[0])
 
 
 class STMO(object):
@@ -13,9 +93,10 @@ class STMO(object):
     """
     RedashClientException = RedashClient.RedashClientException
 
-    def __init__(self, redash_api_key, conf=None):
+    def __init__(self, redash_api_key, conf=None, index=None):
         self.conf = conf or Conf()
-        self._redash = RedashClient(redash_api_key)
+        self.index = index or QueryIndex()
+        self._redash = InstrumentedRedashClient(redash_api_key)
         self.redash_api_key = redash_api_key
 
     def get_tracked_filenames(self):
@@ -29,15 +110,273 @@ class STMO(object):
 
         Returns:
             query (dict): The response from redash, representing a Query model.
+                Only the fields in QUERY_FIELDS are kept; large fields like
+                `visualizations` are skipped while the response is parsed.
         """
         # Get query:
         # https://github.com/getredash/redash/blob/1573e06e710733714d47940cc1cb196b8116f670/redash/handlers/api.py#L74
         url_path = "queries/{}?api_key={}".format(query_id, self.redash_api_key)
+        return self._redash._make_streaming_request(
+            urljoin(self._redash.API_BASE_URL, url_path),
+            lambda body: load_fields(body, QUERY_FIELDS)
+        )
+
+    def iter_queries(self, page_size=250):
+        """Iterates over the summaries of every query visible to the user.
+
+        Args:
+            page_size (int): Number of queries to request per page
+
+        Yields:
+            query (dict): The `id`, `name` and `updated_at` of a query from
+                Redash's listing endpoint
+        """
+        # List queries:
+        # https://github.com/getredash/redash/blob/1573e06e710733714d47940cc1cb196b8116f670/redash/handlers/queries.py#L97
+        page = 1
+        while True:
+            url_path = "queries?page={}&page_size={}&api_key={}".format(
+                page, page_size, self.redash_api_key)
+            results = self._redash._make_streaming_request(
+                urljoin(self._redash.API_BASE_URL, url_path),
+                lambda body: load_page(body, {"id", "name", "updated_at"})
+            )
+            for query in results["results"]:
+                yield query
+            if not results["results"] or page * page_size >= results["count"]:
+                break
+            page += 1
+
+    def sync_index(self):
+        """Brings the local query index up to date with Redash.
+
+        Only queries whose `updated_at` differs from the indexed version are
+        fetched in full; queries no longer visible are dropped from the index.
+
+        Returns:
+            (updated, removed) (tuple): Lists of the query IDs that were
+                (re)indexed and removed
+        """
+        indexed = self.index.get_versions()
+        seen = set()
+        updated = []
+        for summary in self.iter_queries():
+            query_id = str(summary["id"])
+            seen.add(query_id)
+            if indexed.get(query_id) == summary.get("updated_at"):
+                continue
+            self.index.add_query(self.get_query(query_id))
+            updated.append(query_id)
+        removed = sorted(set(indexed) - seen)
+        self.index.remove_queries(removed)
+        return updated, removed
+
+    def search_index(self, term):
+        """Searches the local query index.
+
+        Args:
+            term (str): Text to look for in query names, descriptions and SQL
+
+        Returns:
+            results (list): (query_id, name, file_name) tuples, where file_name
+                is None unless the query is tracked locally.
+        """
+        tracked = {self.conf.get_query(f).id: f for f in self.get_tracked_filenames()}
+        return [(query_id, name, tracked.get(query_id))
+                for query_id, name in self.index.search(term)]
+
+    def get_query_results(self, query_id):
+        """Fetches the latest cached results of a query from Redash.
+
+        Args:
+            query_id (int, str): Redash query ID
+
+        Returns:
+            query_result (dict): The response from redash, representing a QueryResult model,
+                or None if the query has never been run.
+        """
+        url_path = "queries/{}/results.json?api_key={}".format(query_id, self.redash_api_key)
+        try:
+            return self._redash._make_streaming_request(
+                urljoin(self._redash.API_BASE_URL, url_path),
+                lambda body: load_item(body, "query_result")
+            )
+        except self.RedashClientException as e:
+            # Redash responds 404 "No cached result found" for queries that never ran
+            if len(e.args) > 1 and e.args[1] == 404:
+                return None
+            raise
+
+    def create_query(self, query_info, sql):
+        """Creates a new query on Redash.
+
+        Args:
+            query_info (QueryInfo): Metadata for the new query. The id is ignored.
+            sql (str): The query SQL
+
+        Returns:
+            query_info (QueryInfo): Metadata about the created query
+        """
+        args = {
+            "name": query_info.name,
+            "query": sql,
+            "data_source_id": query_info.data_source_id,
+            "description": query_info.description,
+            "schedule": query_info.schedule,
+            "options": query_info.options,
+        }
+        url_path = "queries?api_key={}".format(self.redash_api_key)
         results, response = self._redash._make_request(
-            requests.get,
-            urljoin(self._redash.API_BASE_URL, url_path)
+            requests.post,
+            urljoin(self._redash.API_BASE_URL, url_path),
+            json.dumps({k: v for k, v in args.items() if v is not None})
         )
-        return results
+        return QueryInfo.from_query(results)
+
+    def export_queries(self, archive_path, include_results=False, jobs=4):
+        """Writes every tracked query to a gzipped JSON-lines archive.
+
+        Each line holds one query's file name, metadata and SQL, and optionally
+        its latest results, which are null for queries that never ran. Results
+        are fetched `jobs` at a time and written as they arrive, so only a
+        handful of queries are held in memory at once. The archive is written
+        to a temporary file that only replaces `archive_path` once complete.
+
+        Args:
+            archive_path (str): Where to write the archive
+            include_results (bool): Whether to fetch and include the latest results
+            jobs (int): Number of concurrent requests
+
+        Returns:
+            count (int): The number of exported queries
+        """
+        def make_record(file_name):
+            query_info = self.conf.get_query(file_name)
+            with open(file_name, 'r') as fin:
+                record = {
+                    "file_name": file_name,
+                    "query_info": query_info.to_dict(),
+                    "sql": fin.read(),
+                }
+            if include_results:
+                record["results"] = self.get_query_results(query_info.id)
+            return record
+
+        count = 0
+        tmp_path = archive_path + ".tmp"
+        pool = ThreadPool(jobs)
+        try:
+            with gzip.open(tmp_path, 'wb') as archive:
+                for chunk in chunked(sorted(self.get_tracked_filenames()), jobs * 4):
+                    for record in pool.imap(make_record, chunk):
+                        archive.write(json.dumps(record, sort_keys=True).encode("utf-8"))
+                        archive.write(b"\n")
+                        count += 1
+            os.rename(tmp_path, archive_path)
+        finally:
+            pool.close()
+            pool.join()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return count
+
+    def _check_import_path(self, file_name):
+        """Makes sure an archived file name can be written inside the repository.
+
+        Creates missing parent directories.
+
+        Throws:
+            ValueError: if the file name is absolute, outside the directory
+                holding the conf file, a directory, or can't be written
+        """
+        repo = os.path.realpath(os.path.dirname(self.conf.path))
+        path = os.path.realpath(file_name)
+        rel = os.path.relpath(path, repo)
+        if os.path.isabs(file_name) or rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            raise ValueError("file name is not a relative path inside the repository")
+        if os.path.isdir(path):
+            raise ValueError("file name is a directory")
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        except OSError as e:
+            raise ValueError("can't create directory: {}".format(e))
+        if not os.access(directory, os.W_OK) or \
+                (os.path.exists(path) and not os.access(path, os.W_OK)):
+            raise ValueError("file is not writable")
+
+    def import_queries(self, archive_path, data_source_id=None, jobs=4):
+        """Recreates the queries in an archive written by `export_queries`.
+
+        Each query is created on Redash, its SQL is written to the archived
+        file name and it is tracked. The conf file is saved once at the end.
+        Queries whose file name is already tracked are skipped. File names are
+        checked before creating the query; queries whose file name is unsafe
+        or can't be written are reported as failed.
+
+        Args:
+            archive_path (str): Path to the archive
+            data_source_id (int): If given, overrides the archived data sources,
+                e.g. when migrating to another Redash instance
+            jobs (int): Number of concurrent requests
+
+        Returns:
+            (imported, skipped, failed) (tuple): A list of (file_name, query_info)
+                tuples for the created queries, a list of skipped file names, and
+                a list of (file_name, reason) tuples for the failed queries
+        """
+        def read_records():
+            with gzip.open(archive_path, 'rb') as archive:
+                for line in archive:
+                    yield json.loads(line.decode("utf-8"))
+
+        def create(record):
+            file_name = record["file_name"]
+            query_info = QueryInfo.from_dict(record["query_info"])
+            if data_source_id is not None:
+                query_info.data_source_id = data_source_id
+            new_query_info = self.create_query(query_info, record["sql"])
+            try:
+                with open(file_name, "w") as outfile:
+                    outfile.write(record["sql"])
+            except (IOError, OSError) as e:
+                return file_name, None, "created Query ID {} but couldn't write it: {}".format(
+                    new_query_info.id, e)
+            return file_name, new_query_info, None
+
+        imported = []
+        skipped = []
+        failed = []
+        pool = ThreadPool(jobs)
+        try:
+            for chunk in chunked(read_records(), jobs * 4):
+                # Paths are checked here rather than in the pool, so that
+                # records sharing a new directory don't race to create it
+                to_create = []
+                for record in chunk:
+                    file_name = record["file_name"]
+                    if self.conf.has_query(file_name):
+                        skipped.append(file_name)
+                        continue
+                    try:
+                        self._check_import_path(file_name)
+                    except ValueError as e:
+                        failed.append((file_name, str(e)))
+                        continue
+                    to_create.append(record)
+                for file_name, query_info, error in pool.imap(create, to_create):
+                    if error is not None:
+                        failed.append((file_name, error))
+                    else:
+                        self.conf.add_query(file_name, query_info, save=False)
+                        imported.append((file_name, query_info))
+        finally:
+            pool.close()
+            pool.join()
+            if imported:
+                self.conf.save()
+        return imported, skipped, failed
 
     def get_query_metadata(self, file_name):
         return self.conf.get_query(file_name) if self.conf.has_query(file_name) else None
@@ -51,19 +390,26 @@ class STMO(object):
                 If callable, receives the Redash query object as a parameter.
 
         Returns:
-            query_info (QueryInfo): Metadata about the tracked query
+            query_info (QueryInfo): Metadata about the tracked query, or None
+                if the file name is already tracked, in which case the file
+                is left alone
         """
         query = self.get_query(query_id)
         query_file_name = file_name(query) if callable(file_name) else file_name
+        if self.conf.has_query(query_file_name):
+            return None
         with open(query_file_name, "w") as outfile:
             outfile.write(query["query"])
-        query_info = QueryInfo.from_dict(query)
+        query_info = QueryInfo.from_query(query)
         self.conf.add_query(query_file_name, query_info)
         return query_info
 
     def pull_query(self, file_name):
         """Pulls remote query data to disk
 
+        The file is only rewritten if the remote SQL differs from the local
+        SQL by more than formatting and comments.
+
         Args:
             file_name (str): Name of the file_name to update
 
@@ -72,11 +418,14 @@ class STMO(object):
         """
         query_info = self.conf.get_query(file_name)
         query = self.get_query(query_info.id)
+        new_query_info = QueryInfo.from_query(query)
 
-        with open(file_name, "w") as outfile:
-            outfile.write(query["query"])
+        # Leave the local file alone if it only differs in formatting
+        if not (os.path.exists(file_name) and
+                fingerprint_file(file_name) == new_query_info.fingerprint):
+            with open(file_name, "w") as outfile:
+                outfile.write(query["query"])
 
-        new_query_info = QueryInfo.from_dict(query)
         self.conf.update_query(file_name, new_query_info)
 
         return new_query_info
@@ -102,8 +451,29 @@ class STMO(object):
             query_info.data_source_id, query_info.description,
             query_info.options
         )
+        query_info.fingerprint = fingerprint(sql)
+        self.conf.update_query(file_name, query_info)
         return query_info
 
+    def is_modified(self, file_name):
+        """Checks whether a tracked query's SQL changed since it was last pulled or pushed.
+
+        Changes to formatting and comments are ignored.
+
+        Args:
+            file_name (str): file_name of a tracked query
+
+        Returns:
+            modified (bool): True unless the SQL is known to be unchanged
+
+        Throws:
+            KeyError: if query is not tracked
+        """
+        query_info = self.conf.get_query(file_name)
+        if query_info.fingerprint is None or not os.path.exists(file_name):
+            return True
+        return fingerprint_file(file_name) != query_info.fingerprint
+
     def url_for_query(self, file_name):
         meta = self.conf.get_query(file_name)
         return urljoin(RedashClient.BASE_URL, "queries/{}".format(meta.id))
@@ -0,0 +1,126 @@
+"""Incremental parsing of large Redash responses.
+
+Query objects can embed large visualization and option blobs, and listing
+and result responses grow with the number of queries and rows. The helpers
+here parse a response body as it is downloaded and only build the parts the
+caller asks for, so memory use doesn't grow with the size of the parts that
+are thrown away.
+
+Streaming requires ijson 3.1 or later (for `use_float`), which is installed
+with the `streaming` extra on Python 3. Without it the whole body is parsed
+with `json`, with the same results.
+"""
+import json
+
+try:
+    import ijson
+    PARSE_ERRORS = (ValueError, ijson.JSONError)
+except ImportError:  # pragma: no cover
+    ijson = None
+    PARSE_ERRORS = (ValueError,)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ChunkReader(object):
+    """A minimal file-like object over an iterable of byte chunks."""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _filtered_objects(events, prefix, fields):
+    """Builds each JSON object found at `prefix` from ijson events, keeping only `fields`."""
+    obj = key = builder = None
+    for event_prefix, event, value in events:
+        if event_prefix == prefix and event in ("start_map", "map_key", "end_map"):
+            if builder is not None:
+                obj[key] = builder.value
+                builder = None
+            if event == "start_map":
+                obj = {}
+            elif event == "end_map":
+                yield obj
+            elif value in fields:
+                key = value
+                builder = ijson.ObjectBuilder()
+        elif builder is not None:
+            builder.event(event, value)
+
+
+def _parse(stream):
+    return ijson.parse(stream, use_float=True)
+
+
+def load_fields(stream, fields):
+    """Parses a JSON object, keeping only some of its top-level keys.
+
+    Values of other keys are skipped as they are read without being built.
+
+    Args:
+        stream (file): A binary file-like object holding a JSON object
+        fields (set): Top-level keys to keep
+
+    Returns:
+        result (dict): The kept keys that were present, and their values
+    """
+    if ijson is None:
+        document = json.loads(stream.read().decode("utf-8"))
+        return {k: v for k, v in document.items() if k in fields}
+
+    for obj in _filtered_objects(_parse(stream), "", fields):
+        return obj
+
+
+def load_page(stream, item_fields):
+    """Parses a page of a Redash listing, keeping only some keys of each result.
+
+    Args:
+        stream (file): A binary file-like object holding a listing response,
+            like {"count": 2, "page": 1, "page_size": 25, "results": [...]}
+        item_fields (set): Keys to keep in each of the results
+
+    Returns:
+        page (dict): The `count` of the whole listing and the filtered `results`
+    """
+    if ijson is None:
+        document = json.loads(stream.read().decode("utf-8"))
+        return {
+            "count": document["count"],
+            "results": [{k: v for k, v in item.items() if k in item_fields}
+                        for item in document["results"]],
+        }
+
+    page = {}
+
+    def events():
+        for event_prefix, event, value in _parse(stream):
+            if event_prefix == "count" and event == "number":
+                page["count"] = value
+            yield event_prefix, event, value
+
+    page["results"] = list(_filtered_objects(events(), "results.item", item_fields))
+    return page
+
+
+def load_item(stream, prefix):
+    """Parses the JSON value at `prefix`, e.g. "query_result", without holding the raw body."""
+    if ijson is None:
+        document = json.loads(stream.read().decode("utf-8"))
+        for key in prefix.split("."):
+            document = document[key]
+        return document
+
+    for item in ijson.items(stream, prefix, use_float=True):
+        return item
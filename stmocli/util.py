@@ -1,3 +1,4 @@
+from itertools import islice
 import re
 
 
@@ -8,3 +9,17 @@ def name_to_stub(name):
     Ex.: "My Life (And Hard Times)" -> "my_life_and_hard_times"
     """
     return re.sub(r"[^A-Za-z0-9]+", "_", name).strip("_").lower()
+
+
+def chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most `size` items, consuming it lazily.
+
+    Ex.: chunked(range(5), 2) -> [0, 1], [2, 3], [4]
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,4 @@
+import sys
+
+# The asyncio client uses async/await syntax, and aiohttp needs Python 3
+collect_ignore = ["test_aio.py"] if sys.version_info < (3, 7) else []
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+
+from aiohttp import web
+import pytest
+
+from stmocli.aio import AsyncSTMO
+from stmocli.conf import Conf
+from stmocli.metrics import registry
+
+
+QUERIES = {}
+for query_id in ('49741', '62375'):
+    with open('tests/data/{}.json'.format(query_id), 'rt') as infile:
+        QUERIES[query_id] = json.loads(infile.read())
+
+
+class FakeRedash(object):
+    """A local stand-in for the Redash API, serving the queries in tests/data."""
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.queries = {k: dict(v) for k, v in QUERIES.items()}
+        self.updates = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.app = web.Application(middlewares=[self.count_in_flight])
+        self.app.router.add_get('/api/queries/{id}', self.get_query)
+        self.app.router.add_post('/api/queries/{id}', self.update_query)
+        self.app.router.add_post('/api/queries/{id}/refresh', self.refresh)
+        self.app.router.add_post('/api/queries/{id}/fork', self.fork)
+
+    @web.middleware
+    async def count_in_flight(self, request, handler):
+        assert request.query['api_key'] == 'TOTALLY_FAKE_KEY'
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            return await handler(request)
+        finally:
+            self.in_flight -= 1
+
+    async def get_query(self, request):
+        if request.match_info['id'] not in self.queries:
+            return web.json_response({}, status=404)
+        return web.json_response(self.queries[request.match_info['id']])
+
+    async def update_query(self, request):
+        update = json.loads(await request.text())
+        self.updates.append(update)
+        return web.json_response(update)
+
+    async def refresh(self, request):
+        return web.json_response({})
+
+    async def fork(self, request):
+        fork = dict(self.queries[request.match_info['id']], id=1234)
+        self.queries['1234'] = fork
+        return web.json_response(fork)
+
+
+def run_with_server(server, test, concurrency=8, timeout=300):
+    async def main():
+        runner = web.AppRunner(server.app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            async with AsyncSTMO('TOTALLY_FAKE_KEY', concurrency=concurrency, timeout=timeout,
+                                 api_base_url='http://127.0.0.1:{}/api/'.format(port)) as stmo:
+                return await test(stmo)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def repo(tmpdir):
+    cwd = os.getcwd()
+    tmpdir.chdir()
+    yield tmpdir
+    os.chdir(cwd)
+
+
+def test_track_and_pull(repo):
+    async def test(stmo):
+        await stmo.track_query('49741', '49741.sql')
+        with open('49741.sql', 'w') as fout:
+            fout.write("SELECT nonsense FROM testing")
+        return await stmo.pull_query('49741.sql')
+
+    query_info = run_with_server(FakeRedash(), test)
+    assert query_info.id == '49741'
+    with open('49741.sql', 'r') as fin:
+        assert fin.read() == QUERIES['49741']['query']
+    assert Conf().get_query('49741.sql') == query_info
+
+
+def test_push(repo):
+    server = FakeRedash()
+
+    async def test(stmo):
+        await stmo.track_query('49741', 'poc.sql')
+        with open('poc.sql', 'w') as fout:
+            fout.write("SELECT 1")
+        return await stmo.push_query('poc.sql')
+
+    query_info = run_with_server(server, test)
+    assert [u['query'] for u in server.updates] == ["SELECT 1"]
+    assert Conf().get_query('poc.sql').fingerprint == query_info.fingerprint
+
+
+def test_fork(repo):
+    async def test(stmo):
+        return await stmo.fork_query('49741', 'fork.sql')
+
+    run_with_server(FakeRedash(), test)
+    assert Conf().get_query('fork.sql').id == '1234'
+    assert os.path.exists('fork.sql')
+
+
+def test_not_found(repo):
+    async def test(stmo):
+        with pytest.raises(AsyncSTMO.RedashClientException):
+            await stmo.get_query('99999')
+
+    run_with_server(FakeRedash(), test)
+
+
+def test_bounded_concurrency(repo):
+    server = FakeRedash(delay=0.05)
+    file_names = ['{}.sql'.format(i) for i in range(10)]
+
+    async def test(stmo):
+        await asyncio.gather(*[
+            stmo.track_query('49741' if i % 2 else '62375', file_name)
+            for i, file_name in enumerate(file_names)])
+
+    run_with_server(server, test, concurrency=3)
+    assert server.max_in_flight == 3
+    assert sorted(Conf().get_filenames()) == sorted(file_names)
+
+
+def test_timeout(repo):
+    registry.reset()
+
+    async def test(stmo):
+        with pytest.raises(AsyncSTMO.RedashClientException):
+            await stmo.get_query('49741')
+
+    run_with_server(FakeRedash(delay=1), test, timeout=0.1)
+    assert registry.values["http_requests_failed_total"] == 1
+
+
+def test_batched_pull_saves_conf_once(repo):
+    file_names = ['49741.sql', '62375.sql']
+
+    async def test(stmo):
+        for file_name in file_names:
+            await stmo.track_query(file_name.split('.')[0], file_name)
+        with open('.stmocli.conf', 'w') as fout:
+            fout.write('{}')
+        pulled = await asyncio.gather(*[stmo.pull_query(f, save=False) for f in file_names])
+        assert Conf().get_filenames() == {}.keys()
+        await stmo.save_conf()
+        return pulled
+
+    registry.reset()
+    pulled = run_with_server(FakeRedash(), test)
+    assert [Conf().get_query(f) for f in file_names] == pulled
+    # Two saves while tracking, one for the whole batch of pulls
+    assert registry.histograms["conf_save_duration_seconds"][2] == 3
+
+
+def test_save_conf_without_session(repo):
+    async def test():
+        stmo = AsyncSTMO('TOTALLY_FAKE_KEY')
+        await stmo.save_conf()
+        assert stmo._session is None
+
+    asyncio.run(test())
+    assert os.path.exists('.stmocli.conf')
@@ -1,4 +1,5 @@
 from functools import partial
+import gzip
 import hashlib
 import json
 import os
@@ -130,7 +131,7 @@ def test_track_autostub(runner):
 
     with runner.isolated_filesystem():
         with HTTMock(response_49741_content):
-            runner.invoke(
+            result = runner.invoke(
                 cli.cli, [
                     "--redash_api_key",
                     "TOTALLY_FAKE_KEY",
@@ -140,6 +141,8 @@ def test_track_autostub(runner):
                 input="\n")
 
         assert os.path.isfile(expected_filename)
+        assert result.output.strip().endswith(
+            "Tracking Query ID {} in {}".format(query_id, expected_filename))
 
 
 def setup_tracked_query(runner, query_id, file_name, content):
@@ -158,7 +161,7 @@ def setup_tracked_query(runner, query_id, file_name, content):
 
 
 def update_tracked_query(file_name, original_query):
-    updated_query = original_query + "--appended"
+    updated_query = original_query + "\nOFFSET 10"
     with open(file_name, 'w') as fout:
         fout.write(updated_query)
     return updated_query
@@ -293,6 +296,62 @@ def test_push_fail(runner):
         assert "500" in push_result.output
 
 
+def test_push_skips_reformatted(runner):
+    with runner.isolated_filesystem():
+        query_before = setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        with open('poc.sql', 'w') as fout:
+            fout.write("-- Channels\n" + query_before.lower().replace("\n", " ") + "\n")
+
+        with HTTMock(push_response_fail):
+            push_result = runner.invoke(cli.cli, ["push", "poc.sql"])
+        assert push_result.output.strip() == "Query ID 49741 (poc.sql) is unchanged, skipping"
+
+        with HTTMock(push_response):
+            push_result = runner.invoke(cli.cli, ["push", "--force", "poc.sql"])
+        assert "updated with content from poc.sql" in push_result.output
+
+
+def test_push_records_fingerprint(runner):
+    with runner.isolated_filesystem():
+        query_before = setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        update_tracked_query('poc.sql', query_before)
+
+        with HTTMock(push_response):
+            runner.invoke(cli.cli, ["push", "poc.sql"])
+            push_result = runner.invoke(cli.cli, ["push", "poc.sql"])
+        assert "is unchanged, skipping" in push_result.output
+
+
+def test_pull_keeps_local_formatting(runner):
+    with runner.isolated_filesystem():
+        query_before = setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        reformatted = query_before.replace("\n", "  ") + "  -- keep me"
+        with open('poc.sql', 'w') as fout:
+            fout.write(reformatted)
+
+        with HTTMock(response_49741_content):
+            result = runner.invoke(cli.cli, ["pull", "poc.sql"])
+        assert "is up to date" in result.output
+        with open('poc.sql', 'r') as fin:
+            assert fin.read() == reformatted
+
+
+def test_status(runner):
+    with runner.isolated_filesystem():
+        query_before = setup_tracked_query(runner, '49741', '49741.sql', response_49741_content)
+        setup_tracked_query(runner, '62375', '62375.sql', response_62375_content)
+        with open('49741.sql', 'w') as fout:
+            fout.write(query_before + "\n\n-- just a comment\n")
+
+        result = runner.invoke(cli.cli, ["status"])
+        assert result.output == ""
+
+        update_tracked_query('62375.sql', query_before)
+        os.remove('49741.sql')
+        result = runner.invoke(cli.cli, ["status"])
+        assert result.output == "missing:  49741.sql\nmodified: 62375.sql\n"
+
+
 def test_push_untracked(runner):
     file_name = 'missing.sql'
 
@@ -350,6 +409,16 @@ def test_fork_rejects_bogus_filename(runner):
     assert "no file or query" in result.output
 
 
+def test_fork_rejects_tracked_filename(runner):
+    with runner.isolated_filesystem():
+        setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        with HTTMock(fork_response, response_49741_content):
+            result = runner.invoke(cli.cli, ["fork", "49741", "poc.sql"])
+        assert result.exit_code == 1
+        assert 'Query "poc.sql" already tracked!' in result.output
+        assert Conf().get_query("poc.sql").id == '49741'
+
+
 def test_fork_handles_404(runner):
     with runner.isolated_filesystem():
         with HTTMock(not_found_response):
@@ -365,3 +434,314 @@ def test_fork_rejects_untracked_file(runner):
         result = runner.invoke(cli.cli, ["fork", "spam.sql", "fork.sql"])
     assert result.exit_code == 1
     assert "track" in result.output
+
+
+def make_listing_response(queries):
+    @urlmatch(path=r'.*/queries$')
+    def listing_response(url, request):
+        return {
+            'status_code': 200,
+            'content': json.dumps({
+                'count': len(queries),
+                'page': 1,
+                'page_size': 250,
+                'results': queries,
+            })}
+    return listing_response
+
+
+@urlmatch(path=r'.*/queries/49741$')
+def query_49741_match(url, request):
+    return {'status_code': 200, 'content': query_49741_response}
+
+
+@urlmatch(path=r'.*/queries/62375$')
+def query_62375_match(url, request):
+    return {'status_code': 200, 'content': query_62375_response}
+
+
+def summary(response):
+    query = json.loads(response)
+    return {'id': query['id'], 'name': query['name'], 'updated_at': query['updated_at']}
+
+
+def test_index_and_search(runner):
+    listing = make_listing_response([summary(query_49741_response),
+                                     summary(query_62375_response)])
+
+    with runner.isolated_filesystem():
+        setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        with HTTMock(listing, query_49741_match, query_62375_match):
+            result = runner.invoke(cli.cli, ["index"])
+        assert result.exit_code == 0
+        assert "Indexed 2 new or changed queries" in result.output
+
+        result = runner.invoke(cli.cli, ["search", "longitudinal"])
+        assert result.exit_code == 0
+        assert "Query ID 49741 (St. Mocli POC): tracked in poc.sql" in result.output
+        assert "Query ID 62375 (" in result.output
+        assert "not tracked" in result.output
+
+        result = runner.invoke(cli.cli, ["search", "no_such_table_anywhere"])
+        assert result.output == ""
+
+
+def test_index_only_fetches_changed(runner):
+    listing = make_listing_response([summary(query_49741_response),
+                                     summary(query_62375_response)])
+    changed = summary(query_62375_response)
+    changed['updated_at'] = '2099-01-01T00:00:00+00:00'
+
+    with runner.isolated_filesystem():
+        with HTTMock(listing, query_49741_match, query_62375_match):
+            runner.invoke(cli.cli, ["index"])
+
+        fetched = []
+
+        @urlmatch(path=r'.*/queries/\d+$')
+        def recording_query(url, request):
+            fetched.append(url.path.rsplit('/', 1)[-1])
+            return {'status_code': 200, 'content': query_62375_response}
+
+        with HTTMock(make_listing_response([changed]), recording_query):
+            result = runner.invoke(cli.cli, ["index"])
+        assert fetched == ['62375']
+        assert "Indexed 1 new or changed queries, removed 1" in result.output
+
+        result = runner.invoke(cli.cli, ["search", "longitudinal"])
+        assert "49741" not in result.output
+
+
+def test_search_requires_index(runner):
+    with runner.isolated_filesystem():
+        result = runner.invoke(cli.cli, ["search", "spam"])
+    assert result.exit_code == 1
+    assert "'index' first" in result.output
+
+
+@urlmatch(path=r'.*/results.json$')
+def results_response(url, request):
+    return {
+        'status_code': 200,
+        'content': json.dumps({'query_result': {'data': {'rows': [{'n': 1}]}}})
+    }
+
+
+def make_create_response(created):
+    @urlmatch(path=r'.*/queries$', method='POST')
+    def create_response(url, request):
+        query = json.loads(request.body)
+        query['id'] = 1000 + len(created)
+        created.append(query)
+        return {'status_code': 200, 'content': json.dumps(query)}
+    return create_response
+
+
+def test_export_import(runner):
+    with runner.isolated_filesystem():
+        setup_tracked_query(runner, '49741', '49741.sql', response_49741_content)
+        setup_tracked_query(runner, '62375', '62375.sql', response_62375_content)
+        update_tracked_query('49741.sql', 'SELECT 1')
+
+        with HTTMock(results_response):
+            result = runner.invoke(cli.cli, ["export", "--results", "queries.jsonl.gz"])
+        assert result.exit_code == 0
+        assert "Exported 2 queries" in result.output
+        with gzip.open("queries.jsonl.gz", "rb") as archive:
+            records = [json.loads(line.decode("utf-8")) for line in archive]
+        assert [r['file_name'] for r in records] == ['49741.sql', '62375.sql']
+        assert records[0]['query_info']['id'] == '49741'
+        assert records[0]['results']['data']['rows'] == [{'n': 1}]
+
+        os.mkdir("restored")
+        os.rename("queries.jsonl.gz", os.path.join("restored", "queries.jsonl.gz"))
+        os.chdir("restored")
+
+        created = []
+        with HTTMock(make_create_response(created)):
+            result = runner.invoke(cli.cli, [
+                "import", "--data_source_id", "7", "queries.jsonl.gz"])
+        assert result.exit_code == 0
+
+        assert sorted(q['query'] for q in created) == sorted([
+            'SELECT 1\nOFFSET 10',
+            json.loads(query_62375_response)['query'],
+        ])
+        assert all(q['data_source_id'] == 7 for q in created)
+        with open('49741.sql', 'r') as fin:
+            assert fin.read() == 'SELECT 1\nOFFSET 10'
+        conf = Conf()
+        assert set(conf.get_filenames()) == {'49741.sql', '62375.sql'}
+        assert conf.get_query('49741.sql').id in ('1000', '1001')
+
+        with HTTMock(make_create_response(created)):
+            result = runner.invoke(cli.cli, ["import", "queries.jsonl.gz"])
+        assert len(created) == 2
+        assert 'already tracked, skipping' in result.output
+
+
+def test_output_json(runner):
+    with runner.isolated_filesystem():
+        setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        with HTTMock(response_49741_content):
+            result = runner.invoke(cli.cli, ["--output", "json", "pull", "poc.sql", "spam.sql"])
+
+    events = [json.loads(line) for line in result.output.strip().split("\n")]
+    assert events[0]['event'] == 'up_to_date'
+    assert events[0]['query_id'] == '49741'
+    assert events[0]['file_name'] == 'poc.sql'
+    assert events[1]['event'] == 'not_tracked'
+    assert events[1]['file_name'] == 'spam.sql'
+
+
+def test_track_output_json(runner):
+    with runner.isolated_filesystem():
+        with HTTMock(response_49741_content):
+            result = runner.invoke(cli.cli, ["--output", "json", "track", "49741", "poc.sql"])
+        assert json.loads(result.output)["file_name"] == "poc.sql"
+
+        with HTTMock(response_49741_content):
+            result = runner.invoke(cli.cli, ["--output", "json", "track", "49741"], input="\n")
+        assert result.exit_code == 1
+        assert json.loads(result.output)["event"] == "failed"
+        assert not os.path.exists("st_mocli_poc.sql")
+
+
+def test_track_already_tracked_output_json(runner):
+    with runner.isolated_filesystem():
+        setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        with open('poc.sql', 'w') as f:
+            f.write('SELECT "local edit"')
+
+        with HTTMock(response_49741_content):
+            result = runner.invoke(cli.cli, [
+                "--output", "json", "--metrics_file", "stmocli.prom", "track", "49741", "poc.sql"])
+        assert result.exit_code == 0
+        event = json.loads(result.output)
+        assert event["event"] == "already_tracked"
+        assert event["file_name"] == "poc.sql"
+        with open('poc.sql') as f:
+            assert f.read() == 'SELECT "local edit"'
+
+        with open("stmocli.prom", "r") as fin:
+            lines = fin.read().split("\n")
+        assert 'stmocli_queries_skipped_total{command="track"} 1' in lines
+        assert 'stmocli_queries_updated_total{command="track"} 0' in lines
+
+
+def test_metrics_file(runner):
+    with runner.isolated_filesystem():
+        query_before = setup_tracked_query(runner, '49741', '49741.sql', response_49741_content)
+        setup_tracked_query(runner, '62375', '62375.sql', response_62375_content)
+        update_tracked_query('49741.sql', query_before)
+
+        with HTTMock(push_response):
+            result = runner.invoke(cli.cli, ["--metrics_file", "stmocli.prom", "push"])
+        assert result.exit_code == 0
+
+        with open("stmocli.prom", "r") as fin:
+            lines = fin.read().split("\n")
+        assert 'stmocli_queries_processed_total{command="push"} 2' in lines
+        assert 'stmocli_queries_updated_total{command="push"} 1' in lines
+        assert 'stmocli_queries_skipped_total{command="push"} 1' in lines
+        assert 'stmocli_queries_failed_total{command="push"} 0' in lines
+        # One update and one refresh request for the pushed query
+        assert 'stmocli_http_request_duration_seconds_count{command="push"} 2' in lines
+        assert 'stmocli_conf_save_duration_seconds_count{command="push"} 1' in lines
+        assert [f for f in os.listdir(".") if f.startswith(".stmocli-metrics-")] == []
+
+
+def test_metrics_file_written_on_failure(runner):
+    with runner.isolated_filesystem():
+        query_before = setup_tracked_query(runner, '49741', 'poc.sql', response_49741_content)
+        update_tracked_query('poc.sql', query_before)
+
+        with HTTMock(push_response_fail):
+            result = runner.invoke(cli.cli, ["--metrics_file", "stmocli.prom", "push"])
+        assert result.exit_code == 1
+
+        with open("stmocli.prom", "r") as fin:
+            lines = fin.read().split("\n")
+        assert 'stmocli_queries_failed_total{command="push"} 1' in lines
+        assert 'stmocli_http_requests_failed_total{command="push"} 1' in lines
+
+
+@urlmatch(path=r'.*/results.json$')
+def no_results_response(url, request):
+    return {'status_code': 404, 'content': '{"message": "No cached result found for this query."}'}
+
+
+@urlmatch(path=r'.*/results.json$')
+def results_error_response(url, request):
+    return {'status_code': 500, 'content': '{}'}
+
+
+def test_export_never_run_query(runner):
+    with runner.isolated_filesystem():
+        setup_tracked_query(runner, '49741', '49741.sql', response_49741_content)
+        with HTTMock(no_results_response):
+            result = runner.invoke(cli.cli, ["export", "--results", "queries.jsonl.gz"])
+        assert result.exit_code == 0
+        with gzip.open("queries.jsonl.gz", "rb") as archive:
+            records = [json.loads(line.decode("utf-8")) for line in archive]
+        assert records[0]['results'] is None
+
+
+def test_export_failure_leaves_no_archive(runner):
+    with runner.isolated_filesystem():
+        setup_tracked_query(runner, '49741', '49741.sql', response_49741_content)
+        with HTTMock(results_error_response):
+            result = runner.invoke(cli.cli, ["export", "--results", "queries.jsonl.gz"])
+        assert result.exit_code == 1
+        assert sorted(os.listdir(".")) == ['.stmocli.conf', '49741.sql']
+
+
+def write_archive(path, file_names):
+    with gzip.open(path, 'wb') as archive:
+        for file_name in file_names:
+            record = {
+                'file_name': file_name,
+                'query_info': {'id': '1', 'name': file_name, 'data_source_id': 1},
+                'sql': 'SELECT 1',
+            }
+            archive.write(json.dumps(record).encode("utf-8") + b"\n")
+
+
+def test_import_checks_file_names(runner):
+    with runner.isolated_filesystem():
+        os.mkdir("repo")
+        os.chdir("repo")
+        os.mkdir("a_directory")
+        write_archive("queries.jsonl.gz", [
+            "../outside.sql", os.path.abspath("absolute.sql"), "sub/q.sql", "a_directory",
+            "..hidden.sql"])
+
+        created = []
+        with HTTMock(make_create_response(created)):
+            result = runner.invoke(cli.cli, ["import", "queries.jsonl.gz"])
+        assert result.exit_code == 1
+
+        # Only the paths that passed the checks were created on the server
+        assert len(created) == 2
+        assert not os.path.exists(os.path.join("..", "outside.sql"))
+        assert 'Failed to import "../outside.sql": file name is not a relative path' \
+            in result.output
+        assert "file name is not a relative path" in result.output.split("absolute.sql")[1]
+        assert 'Failed to import "a_directory": file name is a directory' in result.output
+
+        with open(os.path.join("sub", "q.sql")) as fin:
+            assert fin.read() == 'SELECT 1'
+        assert set(Conf().get_filenames()) == {'sub/q.sql', '..hidden.sql'}
+
+
+def test_import_creates_shared_directories(runner):
+    with runner.isolated_filesystem():
+        file_names = ["sub/q{}.sql".format(i) for i in range(8)]
+        write_archive("queries.jsonl.gz", file_names)
+
+        created = []
+        with HTTMock(make_create_response(created)):
+            result = runner.invoke(cli.cli, ["import", "--jobs", "8", "queries.jsonl.gz"])
+        assert result.exit_code == 0
+        assert len(created) == 8
+        assert set(Conf().get_filenames()) == set(file_names)
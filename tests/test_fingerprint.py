@@ -0,0 +1,55 @@
+from stmocli.fingerprint import fingerprint, fingerprint_file
+
+
+def test_fingerprint_ignores_formatting():
+    assert fingerprint("SELECT a,\n       b\nFROM t -- note\n") == \
+        fingerprint("select a, b from t")
+    assert fingerprint("SELECT /* inline */ a FROM t") == fingerprint("SELECT a FROM t")
+
+
+def test_fingerprint_keeps_literals_and_identifiers():
+    assert fingerprint("SELECT 'A  b'") != fingerprint("SELECT 'a b'")
+    assert fingerprint("SELECT '-- not a comment'") != fingerprint("SELECT ''")
+    assert fingerprint('SELECT "Col" FROM t') != fingerprint('SELECT "col" FROM t')
+    assert fingerprint("SELECT Foo FROM t") != fingerprint("SELECT foo FROM t")
+    assert fingerprint("SELECT a FROM t") != fingerprint("SELECT b FROM t")
+
+
+def test_fingerprint_file(tmpdir):
+    path = tmpdir.join("q.sql")
+    path.write("SELECT 1\n")
+    assert fingerprint_file(str(path)) == fingerprint("SELECT 1")
+    path.write("SELECT 22\n")
+    assert fingerprint_file(str(path)) == fingerprint("SELECT 22")
+
+
+def test_fingerprint_backslash_in_literal_is_raw():
+    # A standard SQL dialect reads '\' as a complete literal, so '-- x' is a
+    # string here and not a comment; editing it must change the fingerprint.
+    before = "SELECT replace(p, '\\', '-- x') FROM t"
+    after = "SELECT replace(p, '\\', '-- y') FROM t"
+    assert fingerprint(before) != fingerprint(after)
+    assert fingerprint("SELECT 'it\\'s', '-- x', 1") != fingerprint("SELECT 'it\\'s', '-- x', 2")
+    assert fingerprint('SELECT "a\\"b", \'-- y\', 1') != fingerprint('SELECT "a\\"b", \'-- y\', 2')
+    assert fingerprint("SELECT '\\'  FROM t") != fingerprint("select '\\' from t")
+
+
+def test_fingerprint_dollar_quotes():
+    assert fingerprint("SELECT $$a  b$$") != fingerprint("SELECT $$a b$$")
+    assert fingerprint("SELECT $fn$a -- b$fn$, 1") != fingerprint("SELECT $fn$a -- c$fn$, 1")
+    assert fingerprint("SELECT  $fn$a b$fn$") == fingerprint("select $fn$a b$fn$")
+
+
+def test_fingerprint_unterminated_literal_is_raw():
+    for sql in ("SELECT 'abc", 'SELECT "abc', "SELECT 1 /* abc", "SELECT $$abc"):
+        assert fingerprint(sql) != fingerprint(sql + " ")
+        assert fingerprint(sql) != fingerprint(sql.lower())
+
+
+def test_fingerprint_file_cache_keeps_one_entry_per_path(tmpdir):
+    from stmocli.fingerprint import _file_cache
+    path = tmpdir.join("cached.sql")
+    for i in range(5):
+        path.write("SELECT {}\n".format("1" * (i + 1)))
+        fingerprint_file(str(path))
+    assert [k for k in _file_cache if k.endswith("cached.sql")] == [str(path)]
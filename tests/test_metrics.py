@@ -0,0 +1,26 @@
+from stmocli.metrics import Metrics
+
+
+def test_render():
+    metrics = Metrics()
+    metrics.inc("queries_updated_total")
+    metrics.inc("http_bytes_received_total", 100)
+    metrics.observe("http_request_duration_seconds", 0.2)
+    metrics.observe("http_request_duration_seconds", 60)
+
+    lines = metrics.render({"command": "pull"}).split("\n")
+    assert "# TYPE stmocli_queries_updated_total counter" in lines
+    assert 'stmocli_queries_updated_total{command="pull"} 1' in lines
+    assert 'stmocli_http_bytes_received_total{command="pull"} 100' in lines
+    assert 'stmocli_http_request_duration_seconds_bucket{command="pull",le="0.1"} 0' in lines
+    assert 'stmocli_http_request_duration_seconds_bucket{command="pull",le="0.25"} 1' in lines
+    assert 'stmocli_http_request_duration_seconds_bucket{command="pull",le="+Inf"} 2' in lines
+    assert 'stmocli_http_request_duration_seconds_count{command="pull"} 2' in lines
+
+
+def test_write_textfile(tmpdir):
+    path = tmpdir.join("stmocli.prom")
+    metrics = Metrics()
+    metrics.write_textfile(str(path))
+    assert "stmocli_last_run_timestamp_seconds " in path.read()
+    assert tmpdir.listdir() == [path]
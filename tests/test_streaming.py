@@ -0,0 +1,76 @@
+import io
+import json
+
+import pytest
+
+from stmocli.streaming import ChunkReader, load_fields, load_item, load_page
+
+
+QUERY = {
+    "id": 49741,
+    "name": "St. Mocli POC",
+    "options": {"parameters": [{"name": "p", "value": 1.5}]},
+    "query": "SELECT 1",
+    "visualizations": [{"id": 1, "options": {"name": "not the query name"}}],
+    "user": {"id": 276, "name": "Ryan Harter"},
+}
+
+
+def chunked_stream(document, size=7):
+    body = json.dumps(document).encode("utf-8")
+    return ChunkReader(body[i:i + size] for i in range(0, len(body), size))
+
+
+def test_chunk_reader():
+    reader = ChunkReader([b"ab", b"cde", b"f"])
+    assert reader.read(4) == b"abcd"
+    assert reader.read(4) == b"ef"
+    assert reader.read(4) == b""
+
+
+def test_load_fields():
+    result = load_fields(chunked_stream(QUERY), {"id", "name", "options", "query", "schedule"})
+    assert result == {
+        "id": 49741,
+        "name": "St. Mocli POC",
+        "options": {"parameters": [{"name": "p", "value": 1.5}]},
+        "query": "SELECT 1",
+    }
+
+
+def test_load_page():
+    listing = {"count": 3, "page": 1, "page_size": 2, "results": [QUERY, dict(QUERY, id=2)]}
+    page = load_page(chunked_stream(listing), {"id", "name"})
+    assert page == {
+        "count": 3,
+        "results": [{"id": 49741, "name": "St. Mocli POC"}, {"id": 2, "name": "St. Mocli POC"}],
+    }
+
+
+def test_load_item():
+    response = {"query_result": {"data": {"rows": [{"n": 1}]}}}
+    assert load_item(io.BytesIO(json.dumps(response).encode("utf-8")), "query_result") == \
+        response["query_result"]
+
+
+def test_load_fields_memory_is_flat():
+    tracemalloc = pytest.importorskip("tracemalloc")
+    visualization = {"type": "CHART", "options": {"series": [{"x": 1.5, "y": "label"}] * 100}}
+
+    def peak_memory(copies):
+        body = json.dumps(dict(QUERY, visualizations=[visualization] * copies)).encode("utf-8")
+        tracemalloc.start()
+        try:
+            result = load_fields(
+                ChunkReader(body[i:i + 65536] for i in range(0, len(body), 65536)),
+                {"id", "query"})
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert result == {"id": 49741, "query": "SELECT 1"}
+        return len(body), peak
+
+    small_size, small_peak = peak_memory(250)
+    large_size, large_peak = peak_memory(1000)
+    assert large_size - small_size > 1024 * 1024
+    assert large_peak - small_peak < 128 * 1024
@@ -1,6 +1,11 @@
-from stmocli.util import name_to_stub
+from stmocli.util import chunked, name_to_stub
 
 
 def test_name_to_stub():
     assert name_to_stub("My Life (and Hard Times)") == "my_life_and_hard_times"
     assert name_to_stub("#123: Foo") == "123_foo"
+
+
+def test_chunked():
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []